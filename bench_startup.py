@@ -0,0 +1,77 @@
+# bench_startup.py - Cold-start benchmark: time from process start to the first message handled.
+#
+# Usage: python bench_startup.py [--messages 200000] [--trades 50]
+# Seeds a synthetic state file, then runs a fresh child process per mode (JSON only vs binary
+# snapshot) that imports the listener, runs the staged init and pushes one signal through
+# handle_message against an in-process stub broker (so network time is excluded).
+
+import argparse, json, os, subprocess, sys, tempfile, time
+
+T0 = time.perf_counter()
+
+def _child(mode: str):
+    import asyncio
+    marks = {}
+    import telegram_listener
+    marks["import"] = time.perf_counter() - T0
+    import manager
+    manager.init()
+    marks["init"] = time.perf_counter() - T0
+
+    class _StubBroker:
+        def get_account(self): return {"balance": 100.0}
+        def get_quote(self, symbol): return {"bid": 2000.0, "ask": 2000.2}
+        def get_positions(self, lane=None): return {"positions": []}
+        def place_market(self, symbol, side, volume, sl=None, tp=None, client_id=None): return {"ticket": client_id, "price": 2000.1}
+        def place_limit(self, symbol, side, volume, price, sl=None, tp=None, client_id=None): return {"ticket": client_id, "price": price}
+    manager.fx = _StubBroker()
+
+    class _Msg:
+        # distinct id per mode: the json run persists its id as processed
+        chat_id, id, media, reply_to_msg_id = -100777, (1 if mode == "json" else 2), None, None
+        message = "XAUUSD buy now sl 1990 tp 2010"
+    class _Chat:
+        username, id = "benchchannel", -100777
+    class _Event:
+        message = _Msg()
+        async def get_chat(self): return _Chat()
+
+    asyncio.run(telegram_listener.handle_message(_Event()))
+    marks["first_message"] = time.perf_counter() - T0
+    marks["ocr_loaded"] = "pytesseract" in sys.modules
+    marks["mode"] = mode
+    print(json.dumps(marks))
+
+def _seed_state(path: str, messages: int, trades: int):
+    open_trades = {f"T{i}": {"ticket": f"T{i}", "symbol": "EURUSD", "side": "buy", "entry_price": 1.1 + i / 1e4, "volume": 0.1,
+                             "sl": 1.09, "tp1": 1.12, "tp_list": [1.12], "vip": False, "msg_id": f"-100:{i}",
+                             "client_id": f"-100:{i}-0", "opened_at": time.time(), "peak_profit": 0.0, "tp1_profit": 10.0}
+                   for i in range(trades)}
+    state = {"processed_messages": [f"-100{i % 40}:{i}" for i in range(messages)], "open_trades": open_trades, "trade_history": []}
+    with open(path, "w") as f:
+        json.dump(state, f, indent=2)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200000)
+    ap.add_argument("--trades", type=int, default=50)
+    ap.add_argument("--child", choices=["json", "snapshot"])
+    args = ap.parse_args()
+    if args.child:
+        return _child(args.child)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, STATE_JSON=os.path.join(tmp, "state.json"), STATE_SNAPSHOT=os.path.join(tmp, "state.json.bin"),
+                   LOG_CSV=os.path.join(tmp, "trades.csv"))
+        _seed_state(env["STATE_JSON"], args.messages, args.trades)
+        print(f"state: {args.messages} processed ids, {args.trades} open trades, "
+              f"{os.path.getsize(env['STATE_JSON']) / 1e6:.1f} MB JSON")
+        # first run only has the JSON; its save_state() leaves a snapshot behind for the second run
+        for mode in ("json", "snapshot"):
+            out = subprocess.run([sys.executable, __file__, "--child", mode], env=env, capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mode:>8}: import {r['import']*1000:7.1f} ms | init {r['init']*1000:7.1f} ms | "
+                  f"first message handled {r['first_message']*1000:7.1f} ms | ocr loaded={r['ocr_loaded']}")
+
+if __name__ == "__main__":
+    main()
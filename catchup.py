@@ -0,0 +1,122 @@
+# catchup.py - Bounded replay of messages missed while the process was down or Telethon was disconnected.
+#
+# Each channel's backlog is fetched in one get_messages call, parsed with limited parallelism through
+# the listener's extract_signal (which also dedups against live messages), and handed to a sink
+# oldest-first. Stale entry signals are dropped; close/breakeven style commands still apply.
+# The listener functions are passed in by the caller: importing telegram_listener from here would load
+# a second copy of it (with its own _processed set) whenever it runs as __main__.
+
+import asyncio
+import time
+from config import CATCHUP_WINDOW, CATCHUP_LIMIT, CATCHUP_MAX_AGE, CATCHUP_CONCURRENCY
+from manager import is_processed, mark_processed
+
+class _Replay:
+    """Minimal stand-in for a NewMessage event so extract_signal can parse fetched messages."""
+    def __init__(self, message):
+        self.message = message
+
+    async def get_chat(self):
+        return await self.message.get_chat()
+
+def is_stale_entry(item, now=None) -> bool:
+    sig = item["signal"]
+    now = now or time.time()
+    return bool(sig.get("symbol") and sig.get("side")) and now - item.get("date", now) > CATCHUP_MAX_AGE
+
+def dispatch_backlog_item(item, dispatch):
+    """Sink for the coordinator/single process: dedup against the processed store, drop stale entries, then dispatch(item)."""
+    if is_processed(item["mid"]):
+        return
+    if is_stale_entry(item):
+        if not item["signal"].get("commands"):
+            mark_processed(item["mid"])
+            print("Catch-up: dropped stale entry", item["mid"])
+            return
+        # keep the management part of a stale message, never its entry
+        item = dict(item, signal=dict(item["signal"], side=None))
+    dispatch(item)
+
+async def _fetch_backlog(client, channel, min_id: int):
+    msgs = await client.get_messages(channel, limit=CATCHUP_LIMIT, min_id=min_id)
+    cutoff = time.time() - CATCHUP_WINDOW
+    return [m for m in msgs if m.date and m.date.timestamp() >= cutoff]
+
+async def catch_up(client, channels, extract, sink, last_seen=None):
+    sem = asyncio.Semaphore(CATCHUP_CONCURRENCY)
+    seen = last_seen() if last_seen else {}
+
+    async def _fetch(channel):
+        async with sem:
+            try:
+                min_id = seen.get(await client.get_peer_id(channel), 0)
+                return await _fetch_backlog(client, channel, min_id)
+            except Exception as e:
+                print("Catch-up fetch failed for", channel, e)
+                return []
+
+    async def _parse(msg):
+        async with sem:
+            try:
+                return await extract(_Replay(msg))
+            except Exception as e:
+                print("Catch-up parse failed for", msg.id, e)
+                return None
+
+    batches = await asyncio.gather(*(_fetch(c) for c in channels))
+    msgs = sorted((m for batch in batches for m in batch), key=lambda m: (m.date, m.id))
+    items = await asyncio.gather(*(_parse(m) for m in msgs))
+
+    handled = 0
+    for item in items:
+        if item:
+            item["catchup"] = True
+            try:
+                sink(item)
+                handled += 1
+            except Exception as e:
+                print("Catch-up dispatch error:", e)
+        await asyncio.sleep(0)  # live handlers run between backlog items
+    print(f"Catch-up: {handled} missed messages from {len(channels)} channels")
+
+def _transport_up(client) -> bool:
+    # is_connected() is the user's intent and stays True through Telethon's automatic reconnects
+    sender = getattr(client, "_sender", None)
+    return sender._transport_connected() if sender is not None else client.is_connected()
+
+def _hook_reconnect(client, event: asyncio.Event):
+    """Sets event from the sender's auto-reconnect callback (Telethon 1.x), keeping the client's own handler."""
+    sender = getattr(client, "_sender", None)
+    orig = getattr(sender, "_auto_reconnect_callback", None)
+    if sender is None or getattr(orig, "_catchup_event", None) is event:
+        return
+
+    async def _on_reconnect():
+        event.set()
+        if orig:
+            await orig()
+    _on_reconnect._catchup_event = event
+    sender._auto_reconnect_callback = _on_reconnect
+
+async def catchup_loop(client, channels, extract, sink, last_seen=None, poll: float = 1.0):
+    """
+    Runs catch_up once connected, then again after every reconnect: from the sender's reconnect callback,
+    with the transport state polled as a fallback (a reconnect shorter than poll only shows up in the callback).
+    """
+    reconnected = asyncio.Event()
+    up = False
+    while True:
+        _hook_reconnect(client, reconnected)  # re-hooked if Telethon replaced its sender
+        try:
+            await asyncio.wait_for(reconnected.wait(), poll)
+        except asyncio.TimeoutError:
+            pass
+        fired = reconnected.is_set()
+        reconnected.clear()
+        now_up = _transport_up(client)
+        if now_up and (fired or not up):
+            try:
+                await catch_up(client, channels, extract, sink, last_seen)
+            except Exception as e:
+                print("Catch-up error:", e)
+        up = now_up
@@ -30,7 +30,36 @@ TP1_THRESHOLD_PERCENT = float(os.getenv("TP1_THRESHOLD_PERCENT", "75"))
 WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "0.25"))     # seconds between watchdog ticks
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "6"))
 MAX_CONCURRENT_PER_SYMBOL = int(os.getenv("MAX_CONCURRENT_PER_SYMBOL", "3"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))           # parallel close/modify calls for "close all" etc.
+FXAPI_BATCH = os.getenv("FXAPI_BATCH", "0") == "1"                   # backend has a /batch endpoint (local simulator)
+FXAPI_HEDGE = os.getenv("FXAPI_HEDGE", "0") == "1"                   # send a duplicate order POST (same client_id) if slow
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))        # latency percentile that triggers the hedge
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))           # consecutive failures before failing fast
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "10"))              # seconds before a probe request is allowed
+FXAPI_RATE = float(os.getenv("FXAPI_RATE", "20"))                    # provider requests/sec shared by all calls (0 = off)
+FXAPI_BURST = float(os.getenv("FXAPI_BURST", "20"))
+MONITOR_RATE = float(os.getenv("MONITOR_RATE", "8"))                 # cap for watchdog /positions polling
+ORDER_RESERVE = float(os.getenv("ORDER_RESERVE", "2"))               # tokens monitoring reads may never use
+WARM_INTERVAL = float(os.getenv("WARM_INTERVAL", "20"))              # seconds between keep-alive /account pings
+BALANCE_MAX_AGE = float(os.getenv("BALANCE_MAX_AGE", "60"))          # use the warm-path balance if younger than this
+DNS_TTL = float(os.getenv("DNS_TTL", "300"))                         # seconds to reuse the resolved FXAPI address
+DNS_CONNECT_TIMEOUT = float(os.getenv("DNS_CONNECT_TIMEOUT", "0.5"))  # connect timeout on the cached address before resolving afresh
+
+# Image signals: skip media larger than this; OCR a thumbnail first if one is at least this many pixels wide/high
+OCR_MAX_BYTES = int(os.getenv("OCR_MAX_BYTES", str(5 * 1024 * 1024)))
+OCR_MIN_THUMB_PX = int(os.getenv("OCR_MIN_THUMB_PX", "320"))
+
+# Catch-up after restart/reconnect: look back CATCHUP_WINDOW s (max CATCHUP_LIMIT msgs per channel);
+# entry signals older than CATCHUP_MAX_AGE s are dropped, management commands are still applied
+CATCHUP_WINDOW = float(os.getenv("CATCHUP_WINDOW", "3600"))
+CATCHUP_LIMIT = int(os.getenv("CATCHUP_LIMIT", "200"))
+CATCHUP_MAX_AGE = float(os.getenv("CATCHUP_MAX_AGE", "120"))
+CATCHUP_CONCURRENCY = int(os.getenv("CATCHUP_CONCURRENCY", "2"))
+
+# Listener processes: >1 splits TELEGRAM_CHANNELS across worker processes feeding one trade coordinator
+LISTENER_SHARDS = int(os.getenv("LISTENER_SHARDS", "1"))
 
 # Persistence & logs
 LOG_CSV = os.getenv("LOG_CSV", "telegramfxcopier_trades.csv")
 STATE_JSON = os.getenv("STATE_JSON", "telegramfxcopier_state.json")
+STATE_SNAPSHOT = os.getenv("STATE_SNAPSHOT", "")     # optional binary copy of the state (e.g. STATE_JSON + ".bin"); off by default, see README
@@ -1,34 +1,325 @@
 # fxapi_client.py
 # Lightweight FXAPI wrapper: retry + idempotency + helpers.
 
-import requests, time, uuid
-from typing import Optional
-from config import FXAPI_TOKEN, MAX_RETRIES
+import heapq, itertools, json, os, requests, socket, threading, time, uuid
+from collections import deque
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import create_connection
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Dict
+from config import FXAPI_TOKEN, MAX_RETRIES, FXAPI_HEDGE, HEDGE_PERCENTILE, BREAKER_FAILURES, BREAKER_RESET
+from config import FXAPI_RATE, FXAPI_BURST, MONITOR_RATE, ORDER_RESERVE, DNS_TTL, DNS_CONNECT_TIMEOUT
 
-BASE = "https://fxapi.io"  # adapt if your provider uses different base
+BASE = os.getenv("FXAPI_BASE", "https://fxapi.io")  # adapt if your provider uses different base (or a local simulator)
 
-def _retry_post(path, payload, timeout=3):
+class DNSCache:
+    """
+    Cached addresses for the FXAPI host, used only by connections of the FXAPI session (see _session below),
+    so a reconnect after a quiet period skips DNS. refresh() is called from the warm path to keep entries fresh.
+    """
+    def __init__(self, host: str, ttl: float, connect_timeout: float):
+        self.host = host
+        self.ttl = ttl
+        self.connect_timeout = connect_timeout
+        self._cache = {}  # port -> (resolved_at, getaddrinfo result)
+
+    def _lookup(self, port: int, fresh: bool = False):
+        hit = self._cache.get(port)
+        if hit and not fresh and time.monotonic() - hit[0] < self.ttl:
+            return hit[1]
+        res = socket.getaddrinfo(self.host, port, type=socket.SOCK_STREAM)
+        self._cache[port] = (time.monotonic(), res)
+        return res
+
+    def connect(self, conn):
+        """
+        Socket for a urllib3 connection via the first cached address; None lets urllib3 resolve and report errors itself.
+        One short attempt only: a stale address that drops packets must not cost a full connect timeout (or one per
+        cached address) before the fresh lookup.
+        """
+        if conn._dns_host != self.host:
+            return None
+        try:
+            addrs = self._lookup(conn.port)
+        except OSError:
+            return None
+        if not addrs:
+            return None
+        timeout = conn.timeout if isinstance(conn.timeout, (int, float)) else socket.getdefaulttimeout()
+        try:
+            sock = create_connection(addrs[0][4][:2], min(self.connect_timeout, timeout or self.connect_timeout),
+                                     source_address=conn.source_address, socket_options=conn.socket_options)
+        except OSError:
+            self._cache.pop(conn.port, None)  # resolve again, now and on the next connect
+            return None
+        sock.settimeout(timeout)  # back to the caller's timeout for the request itself
+        return sock
+
+    def refresh(self):
+        for port in list(self._cache):
+            try:
+                self._lookup(port, fresh=True)
+            except OSError as e:
+                print("DNS refresh failed, keeping cached address:", e)
+
+_dns = DNSCache(urlsplit(BASE).hostname, DNS_TTL, DNS_CONNECT_TIMEOUT)
+
+# TLS still verifies and sends SNI for the hostname; only the address lookup is cached
+class _DNSCachedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        return _dns.connect(self) or super()._new_conn()
+
+class _DNSCachedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        return _dns.connect(self) or super()._new_conn()
+
+class _DNSCachedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _DNSCachedHTTPConnection
+
+class _DNSCachedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _DNSCachedHTTPSConnection
+
+class DNSCachedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools resolve through _dns instead of a fresh getaddrinfo per connect."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _DNSCachedHTTPPool, "https": _DNSCachedHTTPSPool}
+
+# One pooled keep-alive session for every call; warm() pings through it so the socket stays open.
+# The DNS-caching adapter is mounted for the FXAPI base URL only; any other URL gets a plain adapter.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+_session.mount(BASE, DNSCachedAdapter(pool_connections=2, pool_maxsize=16))
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+class OrderTemplate:
+    """Pre-serialised market-order body for one symbol/volume; only side, sl, tp and client_id are filled per signal."""
+    __slots__ = ("symbol", "volume", "_head")
+
+    def __init__(self, symbol: str, volume: float):
+        self.symbol = symbol
+        self.volume = float(volume)
+        self._head = '{"symbol":%s,"volume":%s,' % (json.dumps(symbol), json.dumps(self.volume))
+
+    def render(self, side: str, sl: Optional[float], tp: Optional[float], client_id: str) -> bytes:
+        return (self._head + '"side":%s,"sl":%s,"tp":%s,"client_id":%s}' % (
+            json.dumps(side), json.dumps(sl), json.dumps(tp), json.dumps(client_id))).encode()
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    """Opens after N consecutive transport/5xx failures; lets one probe through after reset_after seconds."""
+    def __init__(self, failures: int, reset_after: float):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self, path):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_after or self._probing:
+                raise CircuitOpenError(f"{path}: FXAPI circuit open, failing fast")
+            self._probing = True  # half-open: this caller is the probe
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0; self._opened_at = None; self._probing = False
+
+    def record_failure(self, exc):
+        # 4xx means the backend is up and rejected the request; it must not trip the breaker
+        resp = getattr(exc, "response", None)
+        if resp is not None and resp.status_code < 500:
+            self.record_success()
+            return
+        with self._lock:
+            self._count += 1
+            if self._probing or self._count >= self.failures:
+                if self._opened_at is None or self._probing:
+                    print(f"FXAPI circuit opened after {self._count} failures")
+                self._opened_at = time.time(); self._probing = False
+
+breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET)
+
+class LatencyTracker:
+    """Recent successful call latencies; hedge delay = chosen percentile of the window."""
+    def __init__(self, window: int = 50, min_samples: int = 10, default: float = 0.5):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default = default
+        self._lock = threading.Lock()  # hedge-pool threads add() while the caller reads percentile()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            xs = list(self.samples)
+        if len(xs) < self.min_samples:
+            return self.default
+        xs.sort()
+        return xs[min(len(xs)-1, int(len(xs) * pct / 100))]
+
+# Priority lanes: lower number is served first when callers are queued for tokens
+LANES = {"order": 0, "pretrade": 1, "monitor": 2}
+ENDPOINT_LANE = {"/order": "order", "/close": "order", "/modify": "order", "/batch": "order",
+                 "/account": "pretrade", "/quotes": "pretrade", "/positions": "monitor"}
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, need: float) -> float:
+        return max(0.0, (need - self.tokens) / self.rate)
+
+class RateLimiter:
+    """
+    Shared provider bucket + optional per-lane buckets. Waiters are served strictly by lane priority, and
+    monitor reads may not dip into the last `reserve` provider tokens, so orders/closes always go first.
+    rate <= 0 disables limiting (only metrics are kept).
+    """
+    def __init__(self, rate: float, burst: float, lane_rates: Dict[str, float], reserve: float):
+        self.enabled = rate > 0
+        burst = max(1.0, burst)
+        self.bucket = TokenBucket(rate, burst) if self.enabled else None
+        self.lane_buckets = {lane: TokenBucket(r, max(1.0, r)) for lane, r in lane_rates.items() if r > 0}
+        # a monitor read needs 1 + reserve tokens; more than the bucket can ever hold would wait forever
+        self.reserve = min(max(0.0, reserve), burst - 1.0)
+        if self.enabled and self.reserve < reserve:
+            print(f"ORDER_RESERVE {reserve} leaves monitor reads no token of FXAPI_BURST {burst}; clamped to {self.reserve}")
+        self.metrics = {lane: {"calls": 0, "throttled": 0, "wait_total": 0.0, "wait_max": 0.0} for lane in LANES}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _delay(self, lane: str) -> float:
+        """0 if lane may take a token now, else seconds until it could."""
+        need = 1.0 + (self.reserve if lane == "monitor" else 0.0)
+        delay = self.bucket.wait_for(need)
+        lb = self.lane_buckets.get(lane)
+        if lb is not None:
+            delay = max(delay, lb.wait_for(1.0))
+        return delay
+
+    def acquire(self, lane: str):
+        t0 = time.monotonic()
+        if self.enabled:
+            with self._cond:
+                me = (LANES[lane], next(self._seq))
+                heapq.heappush(self._waiting, me)
+                self._cond.notify_all()  # a higher-priority arrival must be re-evaluated by current waiters
+                while True:
+                    now = time.monotonic()
+                    self.bucket.refill(now)
+                    for lb in self.lane_buckets.values():
+                        lb.refill(now)
+                    delay = self._delay(lane)
+                    if self._waiting[0] == me and delay == 0.0:
+                        break
+                    self._cond.wait(timeout=delay if self._waiting[0] == me else 0.05)
+                heapq.heappop(self._waiting)
+                self.bucket.tokens -= 1.0
+                if lane in self.lane_buckets:
+                    self.lane_buckets[lane].tokens -= 1.0
+                self._cond.notify_all()
+        waited = time.monotonic() - t0
+        with self._cond:
+            m = self.metrics[lane]
+            m["calls"] += 1
+            if waited > 0.001:
+                m["throttled"] += 1
+                m["wait_total"] += waited
+                m["wait_max"] = max(m["wait_max"], waited)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._cond:
+            return {lane: dict(m) for lane, m in self.metrics.items()}
+
+limiter = RateLimiter(FXAPI_RATE, FXAPI_BURST, {"monitor": MONITOR_RATE}, ORDER_RESERVE)
+
+order_latency = LatencyTracker()
+_hedge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fxapi-hedge")
+
+def _post_once(url, payload, timeout, tracker=None, lane="order"):
+    limiter.acquire(lane)
+    t0 = time.perf_counter()
+    if isinstance(payload, bytes):
+        r = _session.post(url, data=payload, headers=JSON_HEADERS, timeout=timeout)
+    else:
+        r = _session.post(url, json=payload, timeout=timeout)
+    r.raise_for_status()
+    if tracker is not None:
+        tracker.add(time.perf_counter() - t0)
+    return r.json()
+
+def _hedged_post(url, payload, timeout):
+    """
+    Sends the POST, and if it has not answered within the learned latency percentile sends an identical
+    second one. Only safe for idempotent payloads (orders carry client_id). First success wins.
+    """
+    first = _hedge_pool.submit(_post_once, url, payload, timeout, order_latency)
+    done, _ = wait([first], timeout=order_latency.percentile(HEDGE_PERCENTILE))
+    if done:
+        return first.result()
+    pending = {first, _hedge_pool.submit(_post_once, url, payload, timeout, order_latency)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                return fut.result()
+            error = fut.exception()
+    raise error
+
+def _retry_post(path, payload, timeout=3, hedge=False):
     url = f"{BASE}{path}?token={FXAPI_TOKEN}"
+    lane = ENDPOINT_LANE.get(path, "order")
     backoff = 0.05
     for attempt in range(MAX_RETRIES):
+        breaker.before_call(path)
         try:
-            r = requests.post(url, json=payload, timeout=timeout)
-            r.raise_for_status()
-            return r.json()
-        except Exception:
+            if hedge:
+                res = _hedged_post(url, payload, timeout)
+            else:
+                res = _post_once(url, payload, timeout, lane=lane)
+            breaker.record_success()
+            return res
+        except Exception as e:
+            breaker.record_failure(e)
             time.sleep(backoff)
             backoff = min(backoff*2, 1.0)
     raise RuntimeError(f"POST {path} failed after {MAX_RETRIES} retries")
 
-def _retry_get(path, params=None, timeout=3):
+def _retry_get(path, params=None, timeout=3, lane=None):
     url = f"{BASE}{path}?token={FXAPI_TOKEN}"
+    lane = lane or ENDPOINT_LANE.get(path, "pretrade")
     backoff = 0.05
     for attempt in range(MAX_RETRIES):
+        breaker.before_call(path)
         try:
-            r = requests.get(url, params=params, timeout=timeout)
+            limiter.acquire(lane)
+            r = _session.get(url, params=params, timeout=timeout)
             r.raise_for_status()
+            breaker.record_success()
             return r.json()
-        except Exception:
+        except Exception as e:
+            breaker.record_failure(e)
             time.sleep(backoff)
             backoff = min(backoff*2, 1.0)
     raise RuntimeError(f"GET {path} failed after {MAX_RETRIES} retries")
@@ -36,9 +327,24 @@ def _retry_get(path, params=None, timeout=3):
 class FXAPI:
     def __init__(self):
         self.token = FXAPI_TOKEN
+        self._templates: Dict[str, OrderTemplate] = {}
+
+    def warm(self):
+        """Lightweight keep-alive: refreshes cached DNS and pings /account over the pooled connection."""
+        _dns.refresh()
+        return self.get_account(lane="monitor")
+
+    def prepare_order_template(self, symbol: str, volume: float):
+        tpl = self._templates.get(symbol)
+        if tpl is None or tpl.volume != float(volume):
+            self._templates[symbol] = OrderTemplate(symbol, volume)
 
-    def get_account(self):
-        return _retry_get("/account")
+    def rate_limit_stats(self):
+        """Per-lane call counts and throttle waits (seconds) from the shared limiter."""
+        return limiter.stats()
+
+    def get_account(self, lane: Optional[str]=None):
+        return _retry_get("/account", lane=lane)
 
     def get_quote(self, symbol: str):
         return _retry_get("/quotes", params={"symbols": symbol})
@@ -46,14 +352,18 @@ class FXAPI:
     def place_market(self, symbol: str, side: str, volume: float, sl: Optional[float]=None, tp: Optional[float]=None, client_id: Optional[str]=None):
         if client_id is None:
             client_id = str(uuid.uuid4())
-        payload = {"symbol": symbol, "side": side, "volume": float(volume), "sl": sl, "tp": tp, "client_id": client_id}
-        return _retry_post("/order", payload)
+        tpl = self._templates.get(symbol)
+        if tpl is not None and tpl.volume == float(volume):
+            payload = tpl.render(side, sl, tp, client_id)
+        else:
+            payload = {"symbol": symbol, "side": side, "volume": float(volume), "sl": sl, "tp": tp, "client_id": client_id}
+        return _retry_post("/order", payload, hedge=FXAPI_HEDGE)
 
     def place_limit(self, symbol: str, side: str, volume: float, price: float, sl: Optional[float]=None, tp: Optional[float]=None, client_id: Optional[str]=None):
         if client_id is None:
             client_id = str(uuid.uuid4())
         payload = {"symbol": symbol, "side": side, "volume": float(volume), "price": float(price), "type":"limit", "sl":sl, "tp":tp, "client_id":client_id}
-        return _retry_post("/order", payload)
+        return _retry_post("/order", payload, hedge=FXAPI_HEDGE)
 
     def modify_order(self, ticket: str, sl: Optional[float]=None, tp: Optional[float]=None):
         payload = {"ticket": ticket, "sl": sl, "tp": tp}
@@ -63,86 +373,20 @@ class FXAPI:
         payload = {"ticket": ticket, "volume": volume}
         return _retry_post("/close", payload)
 
-    def get_positions(self):
-        return _retry_get("/positions")
-
-    def get_position(self, ticket=None, symbol=None):
-        res = self.get_positions()
-        for p in res.get("positions", []):
-            if ticket and str(p.get("ticket")) == str(ticket):
-                return p
-            if symbol and p.get("symbol") == symbol:
-                return p
-        return None
-
-    def get_profit(self, ticket=None, symbol=None):
-        p = self.get_position(ticket=ticket, symbol=symbol)
-        if not p:
-            return 0.0
-        return float(p.get("profit", 0.0))        except Exception:
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 1.0)
-    raise RuntimeError(f"GET {path} failed after {MAX_RETRIES} retries")
-
-class FXAPI:
-    def __init__(self):
-        self.token = FXAPI_TOKEN
-
-    def get_account(self):
-        return _retry_get("/account")
-
-    def get_quote(self, symbol: str):
-        # returns { "bid":..., "ask":..., "timestamp":... }
-        return _retry_get("/quotes", params={"symbols": symbol})
-
-    def place_market(self, symbol: str, side: str, volume: float, sl: Optional[float]=None, tp: Optional[float]=None, client_id: Optional[str]=None):
+    def batch(self, ops: List[Dict]):
         """
-        side: "buy" or "sell"
-        returns dict with ticket/id and execution price
+        ops: [{"op": "close"|"modify", "ticket": ..., "volume"/"sl"/"tp": ...}, ...]
+        returns {"results": [...]} in the same order (only on backends exposing /batch, e.g. the local simulator)
         """
-        if client_id is None:
-            client_id = str(uuid.uuid4())
-        payload = {
-            "symbol": symbol,
-            "side": side,
-            "volume": float(volume),
-            "sl": sl,
-            "tp": tp,
-            "client_id": client_id
-        }
-        return _retry_post("/order", payload)
+        return _retry_post("/batch", {"ops": ops})
 
-    def place_limit(self, symbol: str, side: str, volume: float, price: float, sl: Optional[float]=None, tp: Optional[float]=None, client_id: Optional[str]=None):
-        if client_id is None:
-            client_id = str(uuid.uuid4())
-        payload = {
-            "symbol": symbol,
-            "side": side,
-            "volume": float(volume),
-            "price": float(price),
-            "type": "limit",
-            "sl": sl,
-            "tp": tp,
-            "client_id": client_id
-        }
-        return _retry_post("/order", payload)
-
-    def modify_order(self, ticket: str, sl: Optional[float]=None, tp: Optional[float]=None):
-        payload = {"ticket": ticket, "sl": sl, "tp": tp}
-        return _retry_post("/modify", payload)
-
-    def close_order(self, ticket: str, volume: Optional[float]=None):
-        payload = {"ticket": ticket, "volume": volume}
-        return _retry_post("/close", payload)
-
-    def get_positions(self):
-        return _retry_get("/positions")
+    def get_positions(self, lane: Optional[str]=None):
+        # lane="pretrade" when the read gates a new order rather than feeding the watchdog
+        return _retry_get("/positions", lane=lane)
 
     def get_position(self, ticket=None, symbol=None):
-        ps = self.get_positions()
-        if "positions" not in ps:
-            return []
-        for p in ps["positions"]:
+        res = self.get_positions()
+        for p in res.get("positions", []):
             if ticket and str(p.get("ticket")) == str(ticket):
                 return p
             if symbol and p.get("symbol") == symbol:
@@ -11,7 +11,9 @@ import signal
 import os
 from telethon import TelegramClient
 from config import TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_PHONE, TELEGRAM_CHANNELS
-from telegram_listener import handle_message, watchdog_loop  # handler and watchdog coroutine
+from telegram_listener import handle_message, watchdog_loop, warm_loop, extract_signal, dispatch_signal  # handler and background coroutines
+from manager import init as init_manager, last_seen_ids
+from catchup import catchup_loop, dispatch_backlog_item
 
 # Setup logging
 logging.basicConfig(
@@ -29,6 +31,9 @@ SESSION_NAME = os.getenv("TELETHON_SESSION", "telegramfxcopier_session")
 def run():
     loop = asyncio.get_event_loop()
 
+    # Load trade state and create the broker client (no longer done at import time)
+    init_manager()
+
     # Create Telethon client instance (the same used in telegram_listener)
     client = TelegramClient(SESSION_NAME, TELEGRAM_API_ID, TELEGRAM_API_HASH)
 
@@ -46,6 +51,10 @@ def run():
             # but telegram_listener.handle_message already checks incoming events; we keep registration general.
             # Start watchdog loop (runs in background)
             loop.create_task(watchdog_loop())
+            loop.create_task(warm_loop())
+            # Replay messages missed while down (and after each reconnect)
+            loop.create_task(catchup_loop(client, TELEGRAM_CHANNELS, extract_signal,
+                                          lambda item: dispatch_backlog_item(item, dispatch_signal), last_seen_ids))
 
             logger.info(f"Listening on channels: {TELEGRAM_CHANNELS}")
             # Block until disconnected
@@ -1,34 +1,117 @@
 # manager.py
-import json, time, threading
-from typing import Dict, Any
+import json, marshal, os, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
 from fxapi_client import FXAPI
-from config import LOG_CSV, STATE_JSON, NEAR_MISS_PIPS, VIP_PROFIT_TRAIL_PIPS, TP1_THRESHOLD_PERCENT, MAX_CONCURRENT_PER_SYMBOL
+from trades import Trade, TradeBook
+from parser import SYMBOL_MAP
+from config import LOG_CSV, STATE_JSON, STATE_SNAPSHOT, NEAR_MISS_PIPS, VIP_PROFIT_TRAIL_PIPS, TP1_THRESHOLD_PERCENT, MAX_CONCURRENT_PER_SYMBOL, BULK_CONCURRENCY, FXAPI_BATCH, BALANCE_MAX_AGE
 
-fx = FXAPI()
+fx = None  # set by init_broker(); nothing heavy runs at import time
 _lock = threading.Lock()
+_book_lock = threading.Lock()  # watchdog_scan runs in a worker thread; the order path reads _book on the loop thread
 
-_state = {"processed_messages": set(), "open_trades": {}, "trade_history": []}
+_state = {"processed_messages": set(), "open_trades": {}, "trade_history": []}  # open_trades: ticket -> Trade
+_book = TradeBook()
+_warm = {"balance": None, "at": 0.0}  # balance kept fresh by warm_tick() so the order path skips /account
+_throttled_seen = {}  # lane -> throttled count at the last rate-limit report
+
+def _write_atomic(path, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
 def save_state():
     with _lock:
+        s = _state.copy()
+        s["processed_messages"] = list(s["processed_messages"])  # also keeps marshal off its slow set path
+        s["trade_history"] = list(s["trade_history"])  # may run in a worker thread while the loop appends
+        s["open_trades"] = {k: t.to_dict() for k, t in list(s["open_trades"].items())}
         try:
-            s = _state.copy()
-            s["processed_messages"] = list(s["processed_messages"])
-            with open(STATE_JSON, "w") as f:
-                json.dump(s, f, default=str, indent=2)
+            # compact dumps() runs on the C encoder; indent=2 / dump() fall back to pure Python
+            _write_atomic(STATE_JSON, json.dumps(s, default=str, separators=(",", ":")).encode())
         except Exception as e:
             print("State save error:", e)
+        # Binary snapshot written after the JSON so its mtime marks it as the freshest copy.
+        # Opt-in: it loads no faster than the compact JSON and doubles the cost of every save.
+        if not STATE_SNAPSHOT:
+            return
+        try:
+            _write_atomic(STATE_SNAPSHOT, marshal.dumps(s))
+        except Exception as e:
+            print("Snapshot save error:", e)
 
-def load_state():
+def _load_snapshot(check_mtime: bool = True):
+    if not STATE_SNAPSHOT:
+        return None
+    try:
+        snap_mtime = os.path.getmtime(STATE_SNAPSHOT)
+    except OSError:
+        return None
+    if check_mtime and os.path.exists(STATE_JSON) and os.path.getmtime(STATE_JSON) > snap_mtime:
+        return None  # JSON was written (or hand-edited) after the snapshot
     try:
-        with open(STATE_JSON, "r") as f:
-            s = json.load(f)
-            s["processed_messages"] = set(s.get("processed_messages", []))
-            _state.update(s)
-    except FileNotFoundError:
-        pass
+        with open(STATE_SNAPSHOT, "rb") as f:
+            s = marshal.loads(f.read())  # load(f) reads the file in tiny chunks
+        s["processed_messages"] = set(s.get("processed_messages", ()))
+        return s
+    except (EOFError, ValueError, TypeError, OSError) as e:
+        print("Snapshot load error, falling back to JSON:", e)
+        return None
+
+def load_state():
+    s = _load_snapshot()
+    if s is None:
+        try:
+            with open(STATE_JSON, "r") as f:
+                s = json.load(f)
+                s["processed_messages"] = set(s.get("processed_messages", []))
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            # corrupt or half-written JSON: an older snapshot beats starting with no state
+            print("State JSON load error, trying snapshot:", e)
+            s = _load_snapshot(check_mtime=False)
+            if s is None:
+                return
+    s["open_trades"] = {k: Trade.from_dict(v) for k, v in s.get("open_trades", {}).items()}
+    _state.update(s)
+
+def init_state():
+    load_state()
 
-load_state()
+def init_broker():
+    global fx
+    if fx is None:
+        fx = FXAPI()
+    return fx
+
+def init():
+    """Staged start-up, called once by the entrypoint: local state first, then the broker client."""
+    init_state()
+    init_broker()
+
+def _archive_trade(ticket):
+    h = _state["open_trades"].pop(ticket, None)
+    if h:
+        h.closed_at = time.time(); _state["trade_history"].append(h.to_dict())
+
+def _refresh_book(lane: str = "monitor") -> bool:
+    """One /positions call for every open trade: profit by ticket, else by symbol (old get_profit fallback)."""
+    if not _state["open_trades"]:
+        return False
+    res = fx.get_positions(lane=lane)
+    by_ticket, by_symbol = {}, {}
+    for p in (res.get("positions", []) if isinstance(res, dict) else []):
+        pr = float(p.get("profit", 0.0))
+        by_ticket[str(p.get("ticket"))] = pr
+        by_symbol.setdefault(p.get("symbol"), pr)
+    # the HTTP call stays outside the lock so an order never waits on a watchdog /positions
+    with _book_lock:
+        _book.sync(_state["open_trades"])
+        profit = [by_ticket.get(str(k)) or by_symbol.get(t.symbol) or 0.0 for k, t in zip(_book.tickets, _book.trades)]
+        return _book.update_profit(profit)
 
 def log_trade_row(row: Dict[str, Any]):
     import csv, os
@@ -40,6 +123,33 @@ def log_trade_row(row: Dict[str, Any]):
             writer.writeheader()
         writer.writerow(row)
 
+def is_processed(msg_id: str) -> bool:
+    return msg_id in _state["processed_messages"]
+
+def mark_processed(msg_id: str) -> bool:
+    """Records msg_id; False if it was already there."""
+    if msg_id in _state["processed_messages"]:
+        return False
+    _state["processed_messages"].add(msg_id)
+    return True
+
+def unmark_processed(msg_id: str):
+    """Releases a claim taken with mark_processed when the message turned out to need other handling."""
+    _state["processed_messages"].discard(msg_id)
+
+def last_seen_ids() -> Dict[int, int]:
+    """Highest processed message id per chat, used as min_id when fetching a backlog."""
+    seen = {}
+    for mid in _state["processed_messages"]:
+        chat, _, num = str(mid).rpartition(":")
+        try:
+            chat, num = int(chat), int(num)
+        except ValueError:
+            continue
+        if num > seen.get(chat, 0):
+            seen[chat] = num
+    return seen
+
 def calculate_lot(balance: float, last_result: str) -> float:
     if balance <= 15:
         return 0.01
@@ -61,25 +171,24 @@ def open_trade_from_signal(msg_id: str, signal: Dict[str, Any], last_result: str
     price = signal.get("price"); price_range = signal.get("price_range")
     vip = signal.get("vip", False); again = signal.get("again", False)
 
-    count_same = sum(1 for v in _state["open_trades"].values() if v.get("symbol")==sym)
+    with _book_lock:
+        _book.sync(_state["open_trades"])
+        count_same = _book.count_symbol(sym)
     if count_same >= MAX_CONCURRENT_PER_SYMBOL and not again:
         print("Blocked: too many concurrent for", sym); save_state(); return None
 
-    acct = fx.get_account()
-    balance = float(acct.get("balance", 0.0)) if isinstance(acct, dict) else 0.0
+    balance = _warm["balance"] if time.time() - _warm["at"] <= BALANCE_MAX_AGE else None
+    if balance is None:
+        acct = fx.get_account()
+        balance = float(acct.get("balance", 0.0)) if isinstance(acct, dict) else 0.0
     lot = calculate_lot(balance, last_result)
 
     tp1_block = False
-    for v in _state["open_trades"].values():
-        if v.get("symbol")==sym and v.get("side")==side and v.get("tp1"):
-            ticket = v.get("ticket")
-            profit = fx.get_profit(ticket=ticket) or 0.0
-            tp1_profit = v.get("tp1_profit")
-            if tp1_profit:
-                progress = (profit / tp1_profit) * 100 if tp1_profit != 0 else 100
-                if progress < TP1_THRESHOLD_PERCENT:
-                    tp1_block = True; break
-    if tp1_block and not again:
+    if count_same and not again:
+        _refresh_book(lane="pretrade")
+        with _book_lock:
+            tp1_block = _book.tp1_blocked(sym, side, TP1_THRESHOLD_PERCENT)
+    if tp1_block:
         print("Blocked by 75% TP1 rule for", sym); save_state(); return None
 
     client_id = f"{msg_id}-{int(time.time()*1000)}"
@@ -117,11 +226,11 @@ def open_trade_from_signal(msg_id: str, signal: Dict[str, Any], last_result: str
             except:
                 tp1_profit = None
 
-        _state["open_trades"][ticket] = {
-            "ticket": ticket, "symbol": sym, "side": side, "entry_price": entry_price,
-            "volume": lot, "sl": sl, "tp1": tp1, "tp_list": tps, "vip": vip, "msg_id": msg_id,
-            "client_id": client_id, "opened_at": time.time(), "peak_profit": 0.0, "tp1_profit": tp1_profit
-        }
+        _state["open_trades"][ticket] = Trade(
+            ticket=ticket, symbol=sym, side=side, entry_price=entry_price,
+            volume=lot, sl=sl, tp1=tp1, tp_list=tps, vip=vip, msg_id=msg_id,
+            client_id=client_id, opened_at=time.time(), peak_profit=0.0, tp1_profit=tp1_profit
+        )
         log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"open","symbol":sym,"side":side,"volume":lot,"price":entry_price,"sl":sl,"tp":tp1,"ticket":ticket,"notes":f"vip={vip}"})
         save_state()
         return ticket
@@ -130,10 +239,17 @@ def open_trade_from_signal(msg_id: str, signal: Dict[str, Any], last_result: str
         return None
 
 def apply_command_to_trade(msg_id: str, signal: Dict[str, Any], command_text: str):
+    if is_bulk_command(command_text):
+        targets = resolve_command_targets(msg_id, signal)
+        if not targets:
+            # never fall through to "last open trade": that may belong to another channel
+            print("No open trade in this channel for command", command_text); return False
+        return apply_command_bulk(targets, command_text)
+
     target = None
     sym = signal.get("symbol")
     for t,info in _state["open_trades"].items():
-        if sym and info.get("symbol")==sym:
+        if sym and info.symbol==sym:
             target = info; break
     if not target:
         if _state["open_trades"]:
@@ -141,47 +257,184 @@ def apply_command_to_trade(msg_id: str, signal: Dict[str, Any], command_text: st
     if not target:
         print("No open trade for command", command_text); return False
 
-    ticket = target["ticket"]; cmd = command_text.lower()
+    ticket = target.ticket; cmd = command_text.lower()
     if "close half" in cmd or "partial" in cmd or "50" in cmd:
-        fx.close_order(ticket, volume=target["volume"]*0.5)
-        log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"partial_close","symbol":target["symbol"], "side":target["side"], "volume": target["volume"]*0.5, "price":"", "sl":target["sl"], "tp":target.get("tp1"), "ticket":ticket, "notes":"cmd"})
+        fx.close_order(ticket, volume=target.volume*0.5)
+        log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"partial_close","symbol":target.symbol, "side":target.side, "volume": target.volume*0.5, "price":"", "sl":target.sl, "tp":target.tp1, "ticket":ticket, "notes":"cmd"})
     elif "close all" in cmd or "take profit now" in cmd or "tp now" in cmd:
         fx.close_order(ticket)
-        h = _state["open_trades"].pop(ticket, None)
-        if h:
-            h["closed_at"] = time.time(); _state["trade_history"].append(h)
-        log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"close","symbol":target["symbol"], "side":target["side"], "volume": target["volume"], "price":"", "sl":target["sl"], "tp":target.get("tp1"), "ticket":ticket, "notes":"cmd"})
+        _archive_trade(ticket)
+        log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"close","symbol":target.symbol, "side":target.side, "volume": target.volume, "price":"", "sl":target.sl, "tp":target.tp1, "ticket":ticket, "notes":"cmd"})
     elif "breakeven" in cmd or "secure entry" in cmd:
-        entry_price = target.get("entry_price")
+        entry_price = target.entry_price
         if entry_price:
-            fx.modify_order(ticket, sl=entry_price, tp=target.get("tp1"))
-            log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"breakeven","symbol":target["symbol"], "side":target["side"], "volume": target["volume"], "price":"", "sl":entry_price, "tp":target.get("tp1"), "ticket":ticket, "notes":"cmd"})
+            fx.modify_order(ticket, sl=entry_price, tp=target.tp1)
+            log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"breakeven","symbol":target.symbol, "side":target.side, "volume": target.volume, "price":"", "sl":entry_price, "tp":target.tp1, "ticket":ticket, "notes":"cmd"})
     elif "tighten" in cmd:
-        curq = fx.get_quote(target["symbol"])
+        curq = fx.get_quote(target.symbol)
         if curq and "bid" in curq and "ask" in curq:
             curp = (curq["bid"] + curq["ask"])/2.0
-            if target["side"]=="buy":
+            if target.side=="buy":
                 new_sl = round(curp - 0.5, 5)
             else:
                 new_sl = round(curp + 0.5, 5)
             fx.modify_order(ticket, sl=new_sl)
-            log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"tighten_sl","symbol":target["symbol"], "side":target["side"], "volume": target["volume"], "price":"", "sl":new_sl, "tp":target.get("tp1"), "ticket":ticket, "notes":"cmd"})
+            log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"tighten_sl","symbol":target.symbol, "side":target.side, "volume": target.volume, "price":"", "sl":new_sl, "tp":target.tp1, "ticket":ticket, "notes":"cmd"})
     save_state(); return True
 
-def watchdog_tick():
-    for ticket, info in list(_state["open_trades"].items()):
+BULK_COMMANDS = ("close all", "close full", "take profit now", "tp now", "breakeven", "secure entry", "tighten")
+
+def is_bulk_command(command_text: str) -> bool:
+    cmd = command_text.lower()
+    return any(k in cmd for k in BULK_COMMANDS)
+
+def resolve_command_targets(msg_id: str, signal: Dict[str, Any]) -> List[Trade]:
+    """Trades opened from msg_id itself, else every trade from the same channel matching symbol/side (if given)."""
+    trades = list(_state["open_trades"].values())
+    exact = [t for t in trades if t.msg_id == msg_id]
+    if exact:
+        return exact
+    channel = str(msg_id).split(":")[0]
+    sym = signal.get("symbol"); side = signal.get("side")
+    # parse_signal reads the first short word as a symbol ("close all" -> CLOSE); only filter on real ones
+    if sym not in set(SYMBOL_MAP.values()) | {t.symbol for t in trades}:
+        sym = None
+    return [t for t in trades
+            if str(t.msg_id).split(":")[0] == channel
+            and (not sym or t.symbol == sym)
+            and (not side or t.side == side)]
+
+def _plan_bulk_op(target: Trade, cmd: str, quotes: Dict[str, Any]):
+    ticket = target.ticket
+    if "close all" in cmd or "close full" in cmd or "take profit now" in cmd or "tp now" in cmd:
+        return {"op": "close", "ticket": ticket, "volume": None}
+    if "breakeven" in cmd or "secure entry" in cmd:
+        if not target.entry_price:
+            return None
+        return {"op": "modify", "ticket": ticket, "sl": target.entry_price, "tp": target.tp1}
+    if "tighten" in cmd:
+        curq = quotes.get(target.symbol)
+        if not (curq and "bid" in curq and "ask" in curq):
+            return None
+        curp = (curq["bid"] + curq["ask"])/2.0
+        new_sl = round(curp - 0.5, 5) if target.side=="buy" else round(curp + 0.5, 5)
+        return {"op": "modify", "ticket": ticket, "sl": new_sl, "tp": None}
+    return None
+
+def _run_bulk_op(op: Dict[str, Any]):
+    try:
+        if op["op"] == "close":
+            return True, fx.close_order(op["ticket"], volume=op.get("volume"))
+        return True, fx.modify_order(op["ticket"], sl=op.get("sl"), tp=op.get("tp"))
+    except Exception as e:
+        return False, str(e)
+
+def _execute_bulk_ops(ops: List[Dict[str, Any]]):
+    if FXAPI_BATCH:
         try:
-            profit = fx.get_profit(ticket=ticket) or fx.get_profit(symbol=info.get("symbol")) or 0.0
-            if profit > info.get("peak_profit", 0.0):
-                info["peak_profit"] = profit
-            if info.get("vip"):
-                peak = info.get("peak_profit", 0.0)
-                if peak - profit >= VIP_PROFIT_TRAIL_PIPS:
-                    fx.close_order(ticket)
-                    log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"vip_close","symbol":info["symbol"], "side":info["side"], "volume":info["volume"], "price":"","sl":info.get("sl"), "tp":info.get("tp1"), "ticket":ticket, "notes":"vip_trail_hit"})
-                    h = _state["open_trades"].pop(ticket, None)
-                    if h:
-                        h["closed_at"] = time.time(); _state["trade_history"].append(h)
+            res = fx.batch(ops).get("results", [])
+            if len(res) == len(ops):
+                return [(not (isinstance(r, dict) and r.get("error")), r) for r in res]
         except Exception as e:
-            print("Watchdog error for", ticket, e)
+            print("Batch endpoint failed, falling back to parallel calls:", e)
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_CONCURRENCY, len(ops)))) as pool:
+        return list(pool.map(_run_bulk_op, ops))
+
+def apply_command_bulk(targets: List[Trade], command_text: str):
+    """Runs one command against all targets concurrently, then records every outcome in one state update."""
+    cmd = command_text.lower()
+    quotes = {}
+    if "tighten" in cmd:
+        for sym in {t.symbol for t in targets}:
+            try:
+                quotes[sym] = fx.get_quote(sym)
+            except Exception as e:
+                print("Quote failed for", sym, e)
+
+    planned = [(t, _plan_bulk_op(t, cmd, quotes)) for t in targets]
+    planned = [(t, op) for t, op in planned if op]
+    if not planned:
+        print("No applicable trades for bulk command", command_text); return False
+    outcomes = _execute_bulk_ops([op for _, op in planned])
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    applied = 0
+    for (target, op), (ok, res) in zip(planned, outcomes):
+        ticket = target.ticket
+        if not ok:
+            print("Bulk command failed for", ticket, res)
+            log_trade_row({"time": now, "action":"cmd_failed","symbol":target.symbol, "side":target.side, "volume": target.volume, "price":"", "sl":target.sl, "tp":target.tp1, "ticket":ticket, "notes":f"{cmd}: {res}"})
+            continue
+        applied += 1
+        if op["op"] == "close":
+            _archive_trade(ticket)
+            action, sl = "close", target.sl
+        else:
+            target.sl = op["sl"]
+            action, sl = ("breakeven" if "tighten" not in cmd else "tighten_sl"), op["sl"]
+        log_trade_row({"time": now, "action":action,"symbol":target.symbol, "side":target.side, "volume": target.volume, "price":"", "sl":sl, "tp":target.tp1, "ticket":ticket, "notes":"cmd_bulk"})
     save_state()
+    print(f"Bulk '{command_text}': {applied}/{len(planned)} trades updated")
+    return applied > 0
+
+def report_rate_limits():
+    """Prints per-lane limiter stats when any lane was throttled since the last report."""
+    stats = fx.rate_limit_stats()
+    if all(m["throttled"] == _throttled_seen.get(lane, 0) for lane, m in stats.items()):
+        return
+    for lane, m in stats.items():
+        _throttled_seen[lane] = m["throttled"]
+    print("Rate limit:", " | ".join(f"{lane} calls={m['calls']} throttled={m['throttled']} "
+                                    f"wait_avg={m['wait_total'] / max(1, m['throttled']):.3f}s wait_max={m['wait_max']:.3f}s"
+                                    for lane, m in stats.items()))
+
+def order_symbols() -> List[str]:
+    """Symbols worth a prepared order template. Call on the loop thread: it reads open_trades."""
+    return sorted(set(SYMBOL_MAP.values()) | {t.symbol for t in list(_state["open_trades"].values())})
+
+def warm_tick(symbols: List[str]):
+    """Keeps the order path hot between signals: /account keep-alive ping, cached balance, per-symbol order templates."""
+    acct = fx.warm()
+    report_rate_limits()
+    if not isinstance(acct, dict) or "balance" not in acct:
+        return
+    balance = float(acct["balance"])
+    _warm["balance"] = balance; _warm["at"] = time.time()
+    lot = calculate_lot(balance, "win")
+    for sym in symbols:
+        fx.prepare_order_template(sym, lot)
+
+def watchdog_scan():
+    """
+    Read-only half of the watchdog, safe in a worker thread: one /positions call, peak profit ratchet and VIP
+    trailing check as array ops. Returns (peaks_changed, [(ticket, Trade)] trail hits); never touches open_trades.
+    """
+    try:
+        changed = _refresh_book()
+    except Exception as e:
+        print("Watchdog error:", e); return False, []
+    with _book_lock:
+        hits = [(_book.tickets[i], _book.trades[i]) for i in _book.trail_hits(VIP_PROFIT_TRAIL_PIPS)]
+    return changed, hits
+
+def close_trail_hits(hits) -> bool:
+    """Closes and archives trail hits; runs on the thread that owns open_trades (the event loop). True if any closed."""
+    closed = False
+    for ticket, info in hits:
+        if ticket not in _state["open_trades"]:
+            continue  # a command closed it since the scan
+        try:
+            fx.close_order(ticket)
+            log_trade_row({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "action":"vip_close","symbol":info.symbol, "side":info.side, "volume":info.volume, "price":"","sl":info.sl, "tp":info.tp1, "ticket":ticket, "notes":"vip_trail_hit"})
+            _archive_trade(ticket)
+            closed = True
+        except Exception as e:
+            print("Watchdog error for", ticket, e)
+    return closed
+
+def watchdog_tick():
+    """One full watchdog pass for single-threaded callers; watchdog_loop splits it across threads."""
+    changed, hits = watchdog_scan()
+    # only persist when a peak moved or a trade closed; saving every 250 ms tick dominated the loop
+    if close_trail_hits(hits) or changed:
+        save_state()
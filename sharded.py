@@ -0,0 +1,144 @@
+# sharded.py - Multi-process listener: N receive/OCR/parse shards + one execution coordinator.
+#
+# Each worker process owns a Telethon client for a slice of TELEGRAM_CHANNELS and only runs
+# the listener's extract_signal. Parsed items are sent over a multiprocessing queue to the
+# coordinator (this process), which is the only place manager state is touched and orders are placed.
+
+import asyncio
+import multiprocessing as mp
+import os
+import sys
+import time
+from queue import Empty
+from config import TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_PHONE, TELEGRAM_CHANNELS, LISTENER_SHARDS
+
+SESSION_NAME = os.getenv("TELETHON_SESSION", "telegramfxcopier_session")
+QUEUE_POLL_TIMEOUT = 1.0      # seconds; how often the coordinator checks worker health when idle
+RESTART_BACKOFF = 5.0         # seconds between restarts of the same crashed shard
+EXIT_NOT_AUTHORIZED = 3       # worker exit code: its session is missing or logged out; never restarted
+
+# spawn: never fork a process that already holds Telethon/SQLite handles
+_ctx = mp.get_context("spawn")
+
+def shard_channels(channels, shards):
+    """Round-robin split so busy channels listed together land on different workers."""
+    shards = max(1, min(shards, len(channels)))
+    return [channels[i::shards] for i in range(shards)]
+
+def _shard_session(idx: int) -> str:
+    # Each shard needs its own login: a copied session shares the auth key, and Telegram drops
+    # or revokes an auth key used from several connections at once.
+    return f"{SESSION_NAME}_shard{idx}"
+
+def missing_sessions(shards: int):
+    return [_shard_session(i) + ".session" for i in range(shards) if not os.path.exists(_shard_session(i) + ".session")]
+
+def login(shards: int = LISTENER_SHARDS):
+    """Interactive one-off login of every shard session (prompts for a code per shard)."""
+    from telethon.sync import TelegramClient
+    for idx in range(len(shard_channels(TELEGRAM_CHANNELS, shards))):
+        with TelegramClient(_shard_session(idx), TELEGRAM_API_ID, TELEGRAM_API_HASH) as client:
+            client.start(phone=TELEGRAM_PHONE)
+            print(f"Shard {idx} session ready:", _shard_session(idx) + ".session")
+
+def _worker_main(idx: int, channels, queue, extract_signal):
+    # extract_signal is pickled by reference, so the worker uses the listener module spawn already loaded
+    from telethon import TelegramClient, events
+    from catchup import catchup_loop
+
+    async def _run():
+        client = TelegramClient(_shard_session(idx), TELEGRAM_API_ID, TELEGRAM_API_HASH)
+
+        async def _on_message(event):
+            try:
+                item = await extract_signal(event)
+                if item:
+                    queue.put(item)
+            except Exception as e:
+                print(f"Shard {idx} handle error:", e)
+
+        # never start(): a worker has no terminal to answer a login prompt
+        await client.connect()
+        if not await client.is_user_authorized():
+            print(f"Shard {idx}: session {_shard_session(idx)}.session is not logged in; run: python sharded.py login")
+            sys.exit(EXIT_NOT_AUTHORIZED)
+        client.add_event_handler(_on_message, events.NewMessage(chats=channels))
+        # backlog items are deduped and staleness-filtered by the coordinator, which owns the processed store
+        asyncio.create_task(catchup_loop(client, channels, extract_signal, queue.put))
+        print(f"Shard {idx} listening to:", channels)
+        await client.run_until_disconnected()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+
+def _start_worker(idx: int, channels, queue, extract_signal):
+    p = _ctx.Process(target=_worker_main, args=(idx, channels, queue, extract_signal), name=f"listener-shard-{idx}", daemon=True)
+    p.start()
+    return p
+
+def _next_item(queue):
+    try:
+        return queue.get(timeout=QUEUE_POLL_TIMEOUT)
+    except Empty:
+        return None
+
+async def _coordinate(queue, shards, listener):
+    from manager import init as init_manager
+    from catchup import dispatch_backlog_item
+
+    # Only the coordinator loads trade state; workers never touch it
+    init_manager()
+    loop = asyncio.get_running_loop()
+    procs = {idx: _start_worker(idx, chans, queue, listener.extract_signal) for idx, chans in enumerate(shards)}
+    started = {idx: time.time() for idx in procs}
+    asyncio.create_task(listener.watchdog_loop())
+    asyncio.create_task(listener.warm_loop())
+    print(f"Coordinator running {len(procs)} listener shards:", shards)
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, _next_item, queue)
+            if item:
+                # Workers are disjoint, but a restarted shard may replay updates after reconnect
+                if item["mid"] not in listener._processed:
+                    listener._processed.add(item["mid"])
+                    try:
+                        if item.get("catchup"):
+                            dispatch_backlog_item(item, listener.dispatch_signal)
+                        else:
+                            listener.dispatch_signal(item)
+                    except Exception as e:
+                        print("Dispatch error:", e)
+
+            for idx, p in list(procs.items()):
+                if p.exitcode == EXIT_NOT_AUTHORIZED:
+                    raise RuntimeError(f"Shard {idx} session is not logged in; run: python sharded.py login")
+                if not p.is_alive() and time.time() - started[idx] >= RESTART_BACKOFF:
+                    print(f"Shard {idx} exited with code {p.exitcode}, restarting")
+                    procs[idx] = _start_worker(idx, shards[idx], queue, listener.extract_signal)
+                    started[idx] = time.time()
+    finally:
+        for p in procs.values():
+            if p.is_alive():
+                p.terminate()
+        for p in procs.values():
+            p.join(timeout=5)
+
+def run(shards: int = LISTENER_SHARDS, listener=None):
+    """listener: the telegram_listener module as loaded by the caller (it may be __main__)."""
+    if listener is None:
+        import telegram_listener as listener
+    channels = shard_channels(TELEGRAM_CHANNELS, shards)
+    missing = missing_sessions(len(channels))
+    if missing:
+        raise RuntimeError(f"Missing shard session files {missing}; run: python sharded.py login")
+    queue = _ctx.Queue()
+    asyncio.run(_coordinate(queue, channels, listener))
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["login"]:
+        login()
+    else:
+        run()
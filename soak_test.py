@@ -0,0 +1,225 @@
+# soak_test.py - Long-running soak harness: listener + manager + watchdog against a local fake broker.
+#
+# Usage: python soak_test.py [--days 3] [--messages-per-hour 6] [--ticks-per-hour 120]
+#                            [--mem-budget-mb 20] [--tick-budget-ms 50] [--tick-growth 3]
+# Simulated time: every simulated hour pushes a batch of synthetic channel messages through
+# telegram_listener.handle_message and runs the watchdog ticks, with the fake broker's prices random-walking.
+# Every --snapshot-hours it records RSS, tracemalloc, CPU, per-tick cost and the size of each structure
+# that can grow without bound. Exits 1 when memory or tick time grows past the budgets.
+
+import argparse, contextlib, json, os, random, sys, tempfile, threading, time, tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+WORKDIR = tempfile.mkdtemp(prefix="soak_")
+PORT = int(os.getenv("SOAK_PORT", "8799"))
+# must be set before config is imported
+os.environ.update({
+    "FXAPI_BASE": f"http://127.0.0.1:{PORT}",
+    "STATE_JSON": os.path.join(WORKDIR, "state.json"),
+    "STATE_SNAPSHOT": os.path.join(WORKDIR, "state.json.bin"),
+    "LOG_CSV": os.path.join(WORKDIR, "trades.csv"),
+    "FXAPI_RATE": "0",   # the soak measures our own cost, not provider throttling
+    "FXAPI_BATCH": "1",
+})
+
+SYMBOLS = {"XAUUSD": 2000.0, "EURUSD": 1.085, "GBPUSD": 1.27, "US30": 34000.0}
+
+class FakeBroker:
+    """In-memory broker: random-walk prices, idempotent orders by client_id, /batch support."""
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.prices = dict(SYMBOLS)
+        self.positions = {}
+        self.by_client_id = {}
+        self.next_ticket = 1
+        self.lock = threading.Lock()
+
+    def step(self):
+        for s, p in self.prices.items():
+            self.prices[s] = p * (1 + self.rng.gauss(0, 0.0005))
+        for pos in self.positions.values():
+            d = 1 if pos["side"] == "buy" else -1
+            pos["profit"] = round((self.prices[pos["symbol"]] - pos["entry"]) * d * pos["volume"] * 100, 2)
+
+    def order(self, body):
+        if body["client_id"] in self.by_client_id:
+            return self.by_client_id[body["client_id"]]
+        ticket = self.next_ticket; self.next_ticket += 1
+        price = self.prices.get(body["symbol"], 100.0)
+        self.positions[ticket] = {"ticket": ticket, "symbol": body["symbol"], "side": body["side"],
+                                  "volume": body["volume"], "entry": price, "profit": 0.0}
+        res = {"ticket": ticket, "price": price}
+        self.by_client_id[body["client_id"]] = res
+        return res
+
+    def close(self, body):
+        return {"ok": self.positions.pop(int(body["ticket"]), None) is not None}
+
+    def handle(self, method, path, body):
+        with self.lock:
+            if path == "/account":
+                return {"balance": 1000.0}
+            if path == "/quotes":
+                self.step()
+                p = self.prices[next(iter(SYMBOLS))]
+                return {"bid": p, "ask": p * 1.0001}
+            if path == "/positions":
+                self.step()
+                return {"positions": [{k: v for k, v in p.items() if k != "entry"} for p in self.positions.values()]}
+            if path == "/order":
+                return self.order(body)
+            if path == "/close":
+                return self.close(body)
+            if path == "/modify":
+                return {"ok": int(body["ticket"]) in self.positions}
+            if path == "/batch":
+                return {"results": [self.close(op) if op["op"] == "close" else {"ok": True} for op in body["ops"]]}
+        return None
+
+def serve(broker: FakeBroker):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body go out in two writes; avoid the 40 ms delayed-ACK stall
+        def log_message(self, *a):
+            pass
+        def _reply(self, method):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n)) if n else None
+            res = broker.handle(method, urlsplit(self.path).path, body)
+            out = json.dumps(res if res is not None else {"error": "not found"}).encode()
+            self.send_response(200 if res is not None else 404)
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+        def do_GET(self):
+            self._reply("GET")
+        def do_POST(self):
+            self._reply("POST")
+    srv = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+CHANNELS = [(-1001, "signalsone"), (-1002, "signalstwo"), (-1003, "forexgdp0")]
+TEMPLATES = ["XAUUSD buy now sl 1990 tp 2010", "EURUSD sell now sl 1.09 tp 1.08", "gold sell now",
+             "GBPUSD buy limit 1.2690-1.2700 sl 1.265 tp 1.275", "breakeven", "close all", "tighten sl",
+             "US30 buy now tp 34100", "market update, no trade"]
+
+class _Msg:
+    def __init__(self, chat_id, mid, text):
+        self.chat_id, self.id, self.message = chat_id, mid, text
+        self.media, self.reply_to_msg_id, self.date = None, None, None
+
+class _Chat:
+    def __init__(self, chat_id, username):
+        self.id, self.username = chat_id, username
+
+class _Event:
+    def __init__(self, msg, chat):
+        self.message, self._chat = msg, chat
+    async def get_chat(self):
+        return self._chat
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3  # peak, not current
+
+def _sizes(tl, manager):
+    st = manager._state
+    files = [f for f in os.listdir(WORKDIR) if not f.startswith(("state.json", "trades.csv"))]
+    return {"listener_processed": len(tl._processed), "processed_messages": len(st["processed_messages"]),
+            "open_trades": len(st["open_trades"]), "trade_history": len(st["trade_history"]),
+            "media_files": len(files),
+            "state_json_kb": round(os.path.getsize(os.environ["STATE_JSON"]) / 1e3, 1) if os.path.exists(os.environ["STATE_JSON"]) else 0.0,
+            "trades_csv_kb": round(os.path.getsize(os.environ["LOG_CSV"]) / 1e3, 1) if os.path.exists(os.environ["LOG_CSV"]) else 0.0}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=float, default=3)
+    ap.add_argument("--messages-per-hour", type=int, default=6)
+    ap.add_argument("--ticks-per-hour", type=int, default=120)
+    ap.add_argument("--snapshot-hours", type=int, default=6)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--verbose", action="store_true", help="show listener/manager output")
+    ap.add_argument("--trace-frames", type=int, default=1, help="tracemalloc frames per allocation (more = slower)")
+    ap.add_argument("--mem-budget-mb", type=float, default=20.0, help="max traced-memory growth after the first snapshot")
+    # tracemalloc roughly triples tick cost; 50 ms traced keeps untraced ticks well inside WATCHDOG_INTERVAL
+    ap.add_argument("--tick-budget-ms", type=float, default=50.0, help="max mean watchdog tick in the last window")
+    ap.add_argument("--tick-growth", type=float, default=3.0, help="max ratio of last to first window mean tick")
+    args = ap.parse_args()
+
+    import asyncio
+    broker = FakeBroker(args.seed)
+    srv = serve(broker)
+    tracemalloc.start(args.trace_frames)
+    import telegram_listener as tl
+    import manager
+    manager.init()
+
+    rng = random.Random(args.seed)
+    hours = int(args.days * 24)
+    mid = 0
+    rows = []
+    tick_sum, tick_count = 0.0, 0  # per snapshot window; a growing list here would pollute the memory numbers
+    first_snap = None
+    print(f"soak: {hours} simulated hours, workdir {WORKDIR}")
+    print(f"{'hour':>5} {'rss_mb':>7} {'traced_mb':>9} {'cpu_s':>6} {'tick_ms':>7}  structures")
+
+    async def _hour():
+        nonlocal mid
+        for _ in range(args.messages_per_hour):
+            chat_id, user = rng.choice(CHANNELS)
+            mid += 1
+            await tl.handle_message(_Event(_Msg(chat_id, mid, rng.choice(TEMPLATES)), _Chat(chat_id, user)))
+
+    quiet = open(os.devnull, "w")
+    for hour in range(1, hours + 1):
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else quiet):
+            asyncio.run(_hour())
+            for _ in range(args.ticks_per_hour):
+                t0 = time.perf_counter()
+                manager.watchdog_tick()
+                tick_sum += time.perf_counter() - t0
+                tick_count += 1
+        if hour % args.snapshot_hours == 0 or hour == hours:
+            snap = tracemalloc.take_snapshot()
+            traced = tracemalloc.get_traced_memory()[0] / 1e6
+            row = {"hour": hour, "rss_mb": _rss_mb(), "traced_mb": traced, "cpu_s": time.process_time(),
+                   "tick_ms": 1000 * tick_sum / tick_count, **_sizes(tl, manager)}
+            tick_sum, tick_count = 0.0, 0
+            rows.append(row)
+            if first_snap is None:
+                first_snap = snap
+            sizes = " ".join(f"{k}={row[k]}" for k in _sizes(tl, manager))
+            print(f"{hour:>5} {row['rss_mb']:>7.1f} {traced:>9.2f} {row['cpu_s']:>6.1f} {row['tick_ms']:>7.3f}  {sizes}")
+
+    srv.shutdown()
+    first, last = rows[0], rows[-1]
+    print("\nper-structure growth (first -> last snapshot):")
+    for k in _sizes(tl, manager):
+        print(f"  {k:>20}: {first[k]} -> {last[k]}")
+    print("\ntop allocation growth:")
+    for stat in snap.compare_to(first_snap, "lineno")[:8]:
+        print("  ", stat)
+
+    failures = []
+    growth = last["traced_mb"] - first["traced_mb"]
+    if growth > args.mem_budget_mb:
+        failures.append(f"traced memory grew {growth:.2f} MB > {args.mem_budget_mb} MB")
+    if last["tick_ms"] > args.tick_budget_ms:
+        failures.append(f"mean tick {last['tick_ms']:.3f} ms > {args.tick_budget_ms} ms")
+    if first["tick_ms"] > 0 and last["tick_ms"] / first["tick_ms"] > args.tick_growth:
+        failures.append(f"tick cost grew x{last['tick_ms'] / first['tick_ms']:.2f} > x{args.tick_growth}")
+    print()
+    if failures:
+        for f in failures:
+            print("FAIL:", f)
+        sys.exit(1)
+    print(f"PASS: memory +{growth:.2f} MB, tick {first['tick_ms']:.3f} -> {last['tick_ms']:.3f} ms")
+
+if __name__ == "__main__":
+    main()
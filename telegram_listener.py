@@ -1,95 +1,181 @@
 # telegram_listener.py - Handles incoming Telegram messages (VIP + normal channels)
 
 import asyncio
+import io
 import os
-import pytesseract
-from PIL import Image
+import sys
+import time
 from telethon import TelegramClient, events
-from config import TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_PHONE, TELEGRAM_CHANNELS, VIP_CHANNELS, WATCHDOG_INTERVAL
+from config import TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_PHONE, TELEGRAM_CHANNELS, VIP_CHANNELS, WATCHDOG_INTERVAL, WARM_INTERVAL, LISTENER_SHARDS, OCR_MAX_BYTES, OCR_MIN_THUMB_PX
 from parser import parse_signal, detect_short_vip
-from manager import open_trade_from_signal, apply_command_to_trade, watchdog_tick, save_state
-from fxapi_client import FXAPI
+from manager import open_trade_from_signal, apply_command_to_trade, watchdog_scan, close_trail_hits, warm_tick, order_symbols, save_state, mark_processed, unmark_processed
+from manager import init as init_manager, last_seen_ids
+from catchup import catchup_loop, dispatch_backlog_item
 
-# Telethon session
+# Telethon session (client is created by init(), not at import)
 session_name = os.getenv("TELETHON_SESSION", "telegramfxcopier_session")
-client = TelegramClient(session_name, TELEGRAM_API_ID, TELEGRAM_API_HASH)
-
-# FX API instance
-fx = FXAPI()
+client = None
 
 # Processed message cache
 _processed = set()
 
-async def handle_message(event):
+# pytesseract + PIL are only imported when the first image arrives
+_ocr = None
+
+def ocr_image(src):
+    """OCR a file path or raw image bytes."""
+    global _ocr
+    if _ocr is None:
+        import pytesseract
+        from PIL import Image
+        _ocr = (pytesseract, Image)
+    pytesseract, Image = _ocr
+    return pytesseract.image_to_string(Image.open(io.BytesIO(src) if isinstance(src, bytes) else src))
+
+def _media_kind(msg):
+    """'photo', 'image' (uncompressed image file) or None for media never worth OCR (video, stickers, voice, docs, oversized)."""
+    f = msg.file
+    if f is not None and f.size and f.size > OCR_MAX_BYTES:
+        return None
+    if msg.photo:
+        return "photo"
+    if msg.document and not (msg.sticker or msg.gif or msg.video) and f is not None and (f.mime_type or "").startswith("image/"):
+        return "image"
+    return None
+
+def _ocr_thumb(sizes, kind):
+    """Type letter of the smallest size still readable by OCR, or None if only the full image will do."""
+    dims = [(getattr(s, "w", 0) * getattr(s, "h", 0), s) for s in (sizes or []) if getattr(s, "w", 0)]
+    if not dims:
+        return None
+    # a photo's largest size is the full image itself; a document's thumbs are all previews of the file
+    largest = max(a for a, _ in dims) if kind == "photo" else float("inf")
+    usable = [(a, s) for a, s in dims if max(s.w, s.h) >= OCR_MIN_THUMB_PX and a < largest]
+    return min(usable, key=lambda x: x[0])[1].type if usable else None
+
+async def _download_and_ocr(msg, thumb=None):
     try:
-        msg = event.message
-        mid = f"{msg.chat_id}:{msg.id}"
-        if mid in _processed:
-            return
-        _processed.add(mid)
+        data = await msg.download_media(file=bytes, thumb=thumb)
+        return await asyncio.to_thread(ocr_image, data)
+    except Exception as e:
+        print("OCR failure:", e)
+        return ""
+
+async def _ocr_text(msg, kind, text):
+    """Thumbnail first; the full-resolution file is only fetched if the thumbnail gives no symbol + side."""
+    media = msg.photo if kind == "photo" else msg.document
+    thumb = _ocr_thumb(media.sizes if kind == "photo" else media.thumbs, kind)
+    if thumb is not None:
+        quick = text + " " + await _download_and_ocr(msg, thumb)
+        sig = parse_signal(quick)
+        if sig.get("symbol") and sig.get("side"):
+            return quick
+    return text + " " + await _download_and_ocr(msg)
+
+def init():
+    """Staged start-up: trade state + broker client, then the Telegram client."""
+    global client
+    init_manager()
+    if client is None:
+        client = TelegramClient(session_name, TELEGRAM_API_ID, TELEGRAM_API_HASH)
+    return client
+
+async def extract_signal(event):
+    """Receive/OCR/parse stage. Returns a picklable dict for dispatch_signal, or None if already seen."""
+    msg = event.message
+    mid = f"{msg.chat_id}:{msg.id}"
+    if mid in _processed:
+        return None
+    _processed.add(mid)
+
+    # Extract text + OCR if the media is an image (downloaded to memory, smallest usable size first)
+    text = msg.message or ""
+    kind = _media_kind(msg) if msg.media else None
+    if kind:
+        text = await _ocr_text(msg, kind, text)
+
+    # Parse initial trade signal
+    signal = parse_signal(text)
+
+    # Identify channel
+    try:
+        chat = await event.get_chat()
+        chat_tag = f"@{getattr(chat, 'username', '')}".lower() if getattr(chat, "username", None) else str(chat.id)
+    except Exception:
+        chat_tag = None
+
+    # VIP detection
+    short_vip = None
+    is_from_vip_channel = (chat_tag and chat_tag.lower() in {c.lower() for c in VIP_CHANNELS})
+    if is_from_vip_channel:
+        short_vip = detect_short_vip(text)
+        if short_vip:
+            signal = short_vip
+
+    # Resolve reply parent here so the execution stage never talks to Telegram
+    parent_mid = None
+    parent_signal = None
+    if getattr(msg, "reply_to_msg_id", None):
+        try:
+            parent = await msg.get_reply_message()
+            parent_mid = f"{parent.chat_id}:{parent.id}"
+            parent_text = parent.message or ""
+            parent_signal = parse_signal(parent_text) or detect_short_vip(parent_text)
+        except Exception as e:
+            print("Reply mapping failed:", e)
 
-        # Extract text + OCR if media
-        text = msg.message or ""
-        if msg.media:
-            img_path = await msg.download_media()
-            try:
-                text += " " + pytesseract.image_to_string(Image.open(img_path))
-            except Exception as e:
-                print("OCR failure:", e)
+    return {"mid": mid, "chat": chat_tag, "signal": signal, "short_vip": bool(short_vip),
+            "parent_mid": parent_mid, "parent_signal": parent_signal,
+            "date": msg.date.timestamp() if msg.date else time.time()}
 
-        # Parse initial trade signal
-        signal = parse_signal(text)
+def dispatch_signal(item):
+    """Execution stage: applies a parsed message to manager state. Only one process may run this."""
+    mid = item["mid"]
+    signal = item["signal"]
 
-        # Identify channel
+    # Handle reply-based updates (follow-ups to old trades).
+    # Commands claim mid before applying anything, so a live message and its catch-up replay never both apply.
+    if item.get("parent_mid") and signal.get("commands"):
+        if not mark_processed(mid):
+            return
         try:
-            chat = await event.get_chat()
-            chat_tag = f"@{getattr(chat, 'username', '')}".lower() if getattr(chat, "username", None) else str(chat.id)
-        except Exception:
-            chat_tag = None
-
-        # VIP detection
-        short_vip = None
-        is_from_vip_channel = (chat_tag and chat_tag.lower() in {c.lower() for c in VIP_CHANNELS})
-        if is_from_vip_channel:
-            short_vip = detect_short_vip(text)
-            if short_vip:
-                signal = short_vip
-
-        # Handle reply-based updates (follow-ups to old trades)
-        if getattr(msg, "reply_to_msg_id", None):
-            try:
-                parent = await msg.get_reply_message()
-                parent_mid = f"{parent.chat_id}:{parent.id}"
-                parent_text = parent.message or ""
-                parent_signal = parse_signal(parent_text) or detect_short_vip(parent_text)
-                for cmd in (signal.get("commands") or []):
-                    if apply_command_to_trade(parent_mid, parent_signal, cmd):
-                        save_state()
-                        return
-            except Exception as e:
-                print("Reply mapping failed:", e)
-
-        # Handle update-only commands (e.g. "move SL", "close trade")
-        if signal.get("commands") and not (signal.get("symbol") and signal.get("side")):
             for cmd in signal["commands"]:
-                if apply_command_to_trade(mid, signal, cmd):
+                if apply_command_to_trade(item["parent_mid"], item["parent_signal"], cmd):
                     save_state()
-            return
+                    return
+        except Exception as e:
+            print("Reply mapping failed:", e)
+        # nothing applied to the parent: the message is still handled below as a command or entry
+        unmark_processed(mid)
 
-        # Handle full trade entries
-        if signal.get("symbol") and signal.get("side"):
-            if short_vip:
-                signal["vip"] = True
-                signal["sl"] = None
-                signal["tps"] = []
-            ticket = open_trade_from_signal(mid, signal, last_result="win")
-            if ticket:
-                print("Opened trade:", ticket, "| VIP =", signal.get("vip", False))
-            else:
-                print("No trade opened for", mid)
-            save_state()
+    # Handle update-only commands (e.g. "move SL", "close trade")
+    if signal.get("commands") and not (signal.get("symbol") and signal.get("side")):
+        if not mark_processed(mid):
             return
+        for cmd in signal["commands"]:
+            if apply_command_to_trade(mid, signal, cmd):
+                save_state()
+        return
+
+    # Handle full trade entries
+    if signal.get("symbol") and signal.get("side"):
+        if item.get("short_vip"):
+            signal["vip"] = True
+            signal["sl"] = None
+            signal["tps"] = []
+        ticket = open_trade_from_signal(mid, signal, last_result="win")
+        if ticket:
+            print("Opened trade:", ticket, "| VIP =", signal.get("vip", False))
+        else:
+            print("No trade opened for", mid)
+        save_state()
+        return
 
+async def handle_message(event):
+    try:
+        item = await extract_signal(event)
+        if item:
+            dispatch_signal(item)
     except Exception as e:
         print("Handle message error:", e)
 
@@ -97,155 +183,44 @@ async def watchdog_loop():
     """Runs periodic background checks."""
     while True:
         try:
-            watchdog_tick()
+            # /positions and the array work block on the rate limiter and HTTP, so they run in a thread;
+            # open_trades is only changed here on the loop, like every other command
+            changed, hits = await asyncio.to_thread(watchdog_scan)
+            if close_trail_hits(hits) or changed:
+                await asyncio.to_thread(save_state)
         except Exception as e:
             print("Watchdog outer error:", e)
         await asyncio.sleep(WATCHDOG_INTERVAL)
 
-async def main():
-    await client.start(phone=TELEGRAM_PHONE)
-    print("✅ Connected. Listening to channels:", TELEGRAM_CHANNELS)
-    client.add_event_handler(handle_message, events.NewMessage(chats=TELEGRAM_CHANNELS))
-    asyncio.create_task(watchdog_loop())
-    await client.run_until_disconnected()
-
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        save_state()
-        print("🛑 Stopped.")            chat_tag = None
-
-        short_vip = None
-        is_from_vip_channel = (chat_tag and chat_tag.lower() in {c.lower() for c in VIP_CHANNELS})
-        if is_from_vip_channel:
-            short_vip = detect_short_vip(text)
-            if short_vip:
-                signal = short_vip
-
-        if getattr(msg, "reply_to_msg_id", None):
-            try:
-                parent = await msg.get_reply_message()
-                parent_mid = f"{parent.chat_id}:{parent.id}"
-                parent_text = parent.message or ""
-                parent_signal = parse_signal(parent_text) or detect_short_vip(parent_text)
-                for cmd in (signal.get("commands") or []):
-                    if apply_command_to_trade(parent_mid, parent_signal, cmd):
-                        save_state(); return
-            except Exception as e:
-                print("Reply mapping failed", e)
-
-        if signal.get("commands") and not (signal.get("symbol") and signal.get("side")):
-            for cmd in signal["commands"]:
-                if apply_command_to_trade(mid, signal, cmd):
-                    save_state()
-            return
-
-        if signal.get("symbol") and signal.get("side"):
-            if short_vip:
-                signal["vip"] = True
-                signal["sl"] = None
-                signal["tps"] = []
-            ticket = open_trade_from_signal(mid, signal, last_result="win")
-            if ticket:
-                print("Opened", ticket, "vip=", signal.get("vip", False))
-            else:
-                print("No trade opened for", mid)
-            save_state(); return
-
-    except Exception as e:
-        print("Handle message error:", e)
-
-async def watchdog_loop():
+async def warm_loop():
+    """Keeps the broker connection, DNS entry and balance/lot cache warm between signals."""
     while True:
         try:
-            watchdog_tick()
+            # symbols are read here, on the loop thread that mutates open_trades
+            await asyncio.to_thread(warm_tick, order_symbols())
         except Exception as e:
-            print("Watchdog outer error:", e)
-        await asyncio.sleep(WATCHDOG_INTERVAL)
+            print("Warm path error:", e)
+        await asyncio.sleep(WARM_INTERVAL)
 
 async def main():
+    init()
     await client.start(phone=TELEGRAM_PHONE)
-    print("Connected. Listening to:", TELEGRAM_CHANNELS)
+    print("✅ Connected. Listening to channels:", TELEGRAM_CHANNELS)
     client.add_event_handler(handle_message, events.NewMessage(chats=TELEGRAM_CHANNELS))
     asyncio.create_task(watchdog_loop())
+    asyncio.create_task(warm_loop())
+    asyncio.create_task(catchup_loop(client, TELEGRAM_CHANNELS, extract_signal,
+                                     lambda item: dispatch_backlog_item(item, dispatch_signal), last_seen_ids))
     await client.run_until_disconnected()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        save_state()
-        print("Stopped.")                ocr_text = pytesseract.image_to_string(Image.open(img_path))
-                text += " " + ocr_text
-            except Exception as e:
-                print("OCR fail", e)
-
-        # parse
-        signal = parse_signal(text)
-
-        # If message is a follow-up (reply), try to map to parent via event.message.reply_to_msg_id
-        if getattr(msg, "reply_to_msg_id", None):
-            # fetch parent
-            try:
-                parent = await msg.get_reply_message()
-                parent_mid = f"{parent.chat_id}:{parent.id}"
-                parent_text = parent.message or ""
-                parent_signal = parse_signal(parent_text)
-                # If this message contains update commands, apply to parent's trade
-                for cmd in signal.get("commands", []):
-                    applied = apply_command_to_trade(parent_mid, parent_signal, cmd)
-                    if applied:
-                        print("Applied command to parent trade:", cmd)
-                        # persist state
-                        save_state()
-                        return
-            except Exception as e:
-                print("Reply mapping failed", e)
-
-        # If message contains only an update command but not a reply, attempt to map by symbol/most recent
-        if signal.get("commands") and not signal.get("side"):
-            # apply each command
-            for cmd in signal["commands"]:
-                applied = apply_command_to_trade(mid, signal, cmd)
-                if applied:
-                    save_state()
-            return
-
-        # Entry signals
-        if signal.get("side") and signal.get("symbol"):
-            # open trade
-            ticket = open_trade_from_signal(mid, signal, last_result="win")  # last_result could be computed from history
-            if ticket:
-                print("Opened trade ticket:", ticket)
-            else:
-                print("No trade opened for message:", mid)
-            save_state()
-            return
-
-    except Exception as e:
-        print("Handle message error:", e)
-
-async def watchdog_loop():
-    while True:
-        try:
-            watchdog_tick()
-        except Exception as e:
-            print("Watchdog outer error:", e)
-        await asyncio.sleep(WATCHDOG_INTERVAL)
-
-async def main():
-    await client.start(phone=TELEGRAM_PHONE)
-    print("Connected to Telegram — listening on", TELEGRAM_CHANNEL)
-    # register handler for that channel
-    client.add_event_handler(handle_message, events.NewMessage(chats=TELEGRAM_CHANNEL))
-    # spawn watchdog
-    asyncio.create_task(watchdog_loop())
-    await client.run_until_disconnected()
-
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
+        if LISTENER_SHARDS > 1:
+            import sharded
+            # hand over this module so the coordinator never re-imports it as telegram_listener
+            sharded.run(listener=sys.modules[__name__])
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
-        print("Exiting...")
         save_state()
+        print("🛑 Stopped.")
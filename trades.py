@@ -0,0 +1,114 @@
+# trades.py - Trade record + columnar (NumPy) view of open trades for the watchdog.
+
+from __future__ import annotations
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+# NumPy adds ~100 ms to cold start; it is imported by the first column build (watchdog), never at import
+np = None
+
+def _numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+@dataclass(slots=True)
+class Trade:
+    ticket: Any
+    symbol: str
+    side: str
+    entry_price: Optional[float]
+    volume: float
+    sl: Optional[float] = None
+    tp1: Optional[float] = None
+    tp_list: List[float] = field(default_factory=list)
+    vip: bool = False
+    msg_id: Optional[str] = None
+    client_id: Optional[str] = None
+    opened_at: float = 0.0
+    peak_profit: float = 0.0
+    tp1_profit: Optional[float] = None
+    closed_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in TRADE_FIELDS}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Trade":
+        # unknown keys from older state files are dropped so the schema stays fixed
+        return cls(**{k: d[k] for k in TRADE_FIELDS if k in d})
+
+TRADE_FIELDS = tuple(f.name for f in fields(Trade))
+
+def _f(x) -> float:
+    return float(x) if x is not None else np.nan
+
+class TradeBook:
+    """
+    Column arrays over the open trades, in dict order. Rebuilt only when the set of tickets changes, and only
+    when an array op needs them; profit / peak_profit are refreshed every watchdog tick with whole-array operations.
+    """
+    def __init__(self):
+        self.tickets: List[Any] = []
+        self.trades: List[Trade] = []
+        self._stale = True
+
+    def _columns(self):
+        if self._stale:
+            self._set_columns(self.trades)
+            self._stale = False
+
+    def _set_columns(self, trades: List[Trade]):
+        _numpy()
+        n = len(trades)
+        self.symbols = np.array([t.symbol for t in trades], dtype=object)
+        self.buy = np.fromiter((t.side == "buy" for t in trades), bool, n)
+        self.vip = np.fromiter((bool(t.vip) for t in trades), bool, n)
+        self.entry_price = np.fromiter((_f(t.entry_price) for t in trades), float, n)
+        self.volume = np.fromiter((_f(t.volume) for t in trades), float, n)
+        self.peak_profit = np.fromiter((_f(t.peak_profit) for t in trades), float, n)
+        # tp1 rule only applies to trades with a tp1 and a non-zero tp1_profit
+        self.tp1_profit = np.fromiter((_f(t.tp1_profit) if t.tp1 and t.tp1_profit else np.nan for t in trades), float, n)
+        self.profit = np.zeros(n)
+
+    def sync(self, open_trades: Dict[Any, Trade]) -> bool:
+        keys = list(open_trades)
+        if keys == self.tickets:
+            return False
+        self.tickets = keys
+        self.trades = list(open_trades.values())
+        self._stale = True
+        return True
+
+    def update_profit(self, profit: List[float]) -> bool:
+        """Stores this tick's profits (in ticket order) and ratchets peak_profit; returns True if any peak moved."""
+        self._columns()
+        profit = np.asarray(profit, dtype=float)
+        self.profit = profit
+        raised = np.flatnonzero(profit > self.peak_profit)
+        if raised.size:
+            self.peak_profit[raised] = profit[raised]
+            for i in raised:
+                self.trades[i].peak_profit = float(profit[i])
+        return bool(raised.size)
+
+    def trail_hits(self, trail: float) -> np.ndarray:
+        self._columns()
+        return np.flatnonzero(self.vip & (self.peak_profit - self.profit >= trail))
+
+    def tp1_progress(self) -> np.ndarray:
+        self._columns()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.profit / self.tp1_profit * 100
+
+    def count_symbol(self, symbol: str) -> int:
+        # plain Python: this runs on the order path, which should not wait for the NumPy import
+        return sum(1 for t in self.trades if t.symbol == symbol)
+
+    def tp1_blocked(self, symbol: str, side: str, threshold: float) -> bool:
+        self._columns()
+        same = (self.symbols == symbol) & (self.buy == (side == "buy"))
+        # NaN progress (no tp1) compares False, matching the old per-trade skip
+        return bool(np.any(same & (self.tp1_progress() < threshold)))